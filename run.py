@@ -26,4 +26,8 @@ if __name__ == "__main__":
         host=settings.host,
         port=settings.port,
         reload=True,  # 開發模式啟用熱重載
+        # uvloop 不支援 Windows，改用標準 asyncio event loop
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        log_level="info",
     )
@@ -1,7 +1,8 @@
 """設定模組 - 從環境變數載入所有配置"""
 
+from dataclasses import dataclass, field
 from enum import Enum
-from functools import lru_cache
+from functools import cached_property, lru_cache
 
 from pydantic import Field
 from pydantic_settings import BaseSettings
@@ -43,6 +44,8 @@ class Settings(BaseSettings):
     # 資料庫設定
     database_type: DatabaseType = Field(default=DatabaseType.SQLITE)
     database_url: str = Field(default="sqlite:///./conversations.db")
+    # 對話紀錄保留天數，每天清除一次過期紀錄 (預設 0 = 永久保留，需明確設定才會刪除)
+    conversation_retention_days: int = Field(default=0)
 
     # Firestore 設定
     firestore_project_id: str = Field(default="")
@@ -52,23 +55,31 @@ class Settings(BaseSettings):
     port: int = Field(default=8000)
     debug: bool = Field(default=False)
 
+    # HTTP 連線設定 (HTTP/2 可在單一連線上同時送出多個請求)
+    http2_enabled: bool = Field(default=True)
+
+    # 各目標的讀取逾時 (秒)，避免單一緩慢的後端拖住整條處理流程
+    forward_timeout_s: float = Field(default=10.0)
+    line_reply_timeout_s: float = Field(default=5.0)
+    notify_timeout_s: float = Field(default=3.0)
+
     # 通知設定 (高價值關鍵字)
     notify_webhook_url: str = Field(default="")
     high_value_keywords: str = Field(default="設立公司,開公司,創業")
 
-    @property
-    def old_keywords_list(self) -> list[str]:
-        """取得舊系統關鍵字列表"""
+    @cached_property
+    def old_keywords_list(self) -> tuple[str, ...]:
+        """取得舊系統關鍵字列表 (只解析一次)"""
         if not self.old_system_keywords:
-            return []
-        return [k.strip() for k in self.old_system_keywords.split(",") if k.strip()]
+            return ()
+        return tuple(k.strip() for k in self.old_system_keywords.split(",") if k.strip())
 
-    @property
-    def high_value_keywords_list(self) -> list[str]:
-        """取得高價值關鍵字列表"""
+    @cached_property
+    def high_value_keywords_list(self) -> tuple[str, ...]:
+        """取得高價值關鍵字列表 (只解析一次)"""
         if not self.high_value_keywords:
-            return []
-        return [k.strip() for k in self.high_value_keywords.split(",") if k.strip()]
+            return ()
+        return tuple(k.strip() for k in self.high_value_keywords.split(",") if k.strip())
 
     model_config = {
         "env_file": ".env",
@@ -81,3 +92,43 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     """取得設定 (使用快取避免重複讀取)"""
     return Settings()
+
+
+@dataclass(slots=True, frozen=True)
+class RuntimeSettings:
+    """執行期設定 - 熱路徑使用的設定快照 (純值，不經過 pydantic)"""
+
+    line_channel_access_token: str = field(repr=False)
+    line_channel_secret_bytes: bytes = field(repr=False)  # 驗證簽名用，啟動時編碼一次
+    old_system_webhook_url: str
+    new_system_webhook_url: str
+    reply_mode: ReplyMode
+    old_keywords_list: tuple[str, ...]
+    high_value_keywords_list: tuple[str, ...]
+    notify_webhook_url: str
+    forward_timeout_s: float
+    line_reply_timeout_s: float
+    notify_timeout_s: float
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "RuntimeSettings":
+        """從應用程式設定複製熱路徑需要的值"""
+        return cls(
+            line_channel_access_token=settings.line_channel_access_token,
+            line_channel_secret_bytes=settings.line_channel_secret.encode("utf-8"),
+            old_system_webhook_url=settings.old_system_webhook_url,
+            new_system_webhook_url=settings.new_system_webhook_url,
+            reply_mode=settings.reply_mode,
+            old_keywords_list=settings.old_keywords_list,
+            high_value_keywords_list=settings.high_value_keywords_list,
+            notify_webhook_url=settings.notify_webhook_url,
+            forward_timeout_s=settings.forward_timeout_s,
+            line_reply_timeout_s=settings.line_reply_timeout_s,
+            notify_timeout_s=settings.notify_timeout_s,
+        )
+
+
+@lru_cache
+def get_runtime_settings() -> RuntimeSettings:
+    """取得執行期設定 (使用快取，整個程序共用同一份)"""
+    return RuntimeSettings.from_settings(get_settings())
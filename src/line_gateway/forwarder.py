@@ -1,15 +1,45 @@
 """轉發服務 - 處理 Webhook 轉發邏輯"""
 
+import asyncio
 import logging
 from dataclasses import dataclass
 
 import httpx
+import orjson
 
-from .config import ReplyMode, get_settings
+from .config import ReplyMode, get_runtime_settings
+from .http_clients import make_client, make_timeout
 from .router import RouteResult, RouteTarget
 
 logger = logging.getLogger(__name__)
 
+# 這些 header 不應該轉發 (ASGI 的原始 header 名稱一律為小寫 bytes)
+_SKIP_HEADERS = frozenset(
+    {
+        b"host",
+        b"content-length",  # httpx 會自動計算
+        b"transfer-encoding",
+        b"connection",
+    }
+)
+
+
+def build_forward_headers(raw_headers: list[tuple[bytes, bytes]]) -> dict[str, str]:
+    """
+    從原始 Request headers 建立要轉發的 Headers，移除不該轉發的
+
+    Args:
+        raw_headers: Starlette 的 request.headers.raw
+
+    Returns:
+        dict[str, str]: 可直接轉發的 Headers
+    """
+    return {
+        name.decode("latin-1"): value.decode("latin-1")
+        for name, value in raw_headers
+        if name not in _SKIP_HEADERS
+    }
+
 
 @dataclass
 class ForwardResult:
@@ -25,9 +55,15 @@ class ForwardResult:
 class WebhookForwarder:
     """Webhook 轉發器"""
 
-    def __init__(self):
-        self.settings = get_settings()
-        self.client = httpx.AsyncClient(timeout=30.0)
+    def __init__(self, client: httpx.AsyncClient | None = None):
+        """
+        Args:
+            client: 共用的 HTTP client (未提供時自行建立)
+        """
+        self.settings = get_runtime_settings()
+        self._owns_client = client is None
+        self.client = client or make_client()
+        self.timeout = make_timeout(self.settings.forward_timeout_s)
 
     async def forward_to_old_system(
         self,
@@ -40,7 +76,7 @@ class WebhookForwarder:
 
         Args:
             body: 原始 Request body
-            headers: 原始 Headers (會過濾掉 host 等不需要的 header)
+            headers: 要轉發的 Headers (見 build_forward_headers)
             include_reply_token: 是否保留 reply_token (如果要讓舊系統回覆)
 
         Returns:
@@ -70,7 +106,7 @@ class WebhookForwarder:
 
         Args:
             body: 原始 Request body
-            headers: 原始 Headers
+            headers: 要轉發的 Headers
 
         Returns:
             ForwardResult: 轉發結果
@@ -101,7 +137,7 @@ class WebhookForwarder:
         Args:
             route_result: 路由判斷結果
             body: 原始 Request body
-            headers: 原始 Headers
+            headers: 要轉發的 Headers
 
         Returns:
             list[ForwardResult]: 轉發結果列表
@@ -126,11 +162,12 @@ class WebhookForwarder:
             results.append(result)
 
         elif route_result.target == RouteTarget.BOTH:
-            # 兩邊都轉發
-            old_result = await self.forward_to_old_system(
-                body, headers, include_reply_token=False
+            # 兩邊都轉發 (同時送出，延遲取決於較慢的一方)
+            old_task = asyncio.create_task(
+                self.forward_to_old_system(body, headers, include_reply_token=False)
             )
-            new_result = await self.forward_to_new_system(body, headers)
+            new_task = asyncio.create_task(self.forward_to_new_system(body, headers))
+            old_result, new_result = await asyncio.gather(old_task, new_task)
             results.extend([old_result, new_result])
 
         return results
@@ -143,20 +180,18 @@ class WebhookForwarder:
         target: str,
     ) -> ForwardResult:
         """內部轉發方法"""
-        # 過濾掉不需要轉發的 headers
-        forward_headers = self._filter_headers(headers)
-
         try:
             response = await self.client.post(
                 url,
                 content=body,
-                headers=forward_headers,
+                headers=headers,
+                timeout=self.timeout,
             )
 
-            # 嘗試解析 JSON 回應
+            # 嘗試解析 JSON 回應 (直接解析 bytes，不先解碼成字串)
             try:
-                response_body = response.json()
-            except Exception:
+                response_body = orjson.loads(response.content)
+            except orjson.JSONDecodeError:
                 response_body = response.text
 
             success = 200 <= response.status_code < 300
@@ -173,8 +208,16 @@ class WebhookForwarder:
                 response_body=response_body,
             )
 
-        except httpx.TimeoutException:
-            logger.error(f"轉發到 {target} 超時: {url}")
+        except httpx.PoolTimeout:
+            # 連線池已滿，請求根本沒有送出
+            logger.error(f"轉發到 {target} 超時 (等待連線池): {url}")
+            return ForwardResult(
+                success=False,
+                target=target,
+                error="等待連線池超時",
+            )
+        except httpx.TimeoutException as e:
+            logger.error(f"轉發到 {target} 超時 ({type(e).__name__}): {url}")
             return ForwardResult(
                 success=False,
                 target=target,
@@ -188,34 +231,7 @@ class WebhookForwarder:
                 error=str(e),
             )
 
-    def _filter_headers(self, headers: dict) -> dict:
-        """過濾 Headers，移除不該轉發的"""
-        # 這些 header 不應該轉發
-        skip_headers = {
-            "host",
-            "content-length",  # httpx 會自動計算
-            "transfer-encoding",
-            "connection",
-        }
-
-        return {
-            k: v
-            for k, v in headers.items()
-            if k.lower() not in skip_headers
-        }
-
     async def close(self):
-        """關閉 HTTP client"""
-        await self.client.aclose()
-
-
-# 模組層級實例
-_forwarder: WebhookForwarder | None = None
-
-
-def get_forwarder() -> WebhookForwarder:
-    """取得轉發器實例"""
-    global _forwarder
-    if _forwarder is None:
-        _forwarder = WebhookForwarder()
-    return _forwarder
+        """關閉 HTTP client (共用的 client 由建立者負責關閉)"""
+        if self._owns_client:
+            await self.client.aclose()
@@ -0,0 +1,43 @@
+"""HTTP Client 模組 - 所有對外請求共用同一個連線池"""
+
+import httpx
+
+from .config import get_settings
+
+
+def make_client(http2: bool | None = None) -> httpx.AsyncClient:
+    """
+    建立共用的 HTTP client
+
+    轉發器、LINE 回覆與通知服務共用同一個連線池，
+    重複使用 TCP/TLS 連線，避免每個服務各自維護連線狀態。
+
+    Args:
+        http2: 是否啟用 HTTP/2 (透過 ALPN 協商，不支援的目標會退回 HTTP/1.1)；
+            未指定時依 HTTP2_ENABLED 設定
+
+    Returns:
+        httpx.AsyncClient: 設定好連線上限與逾時的 client
+    """
+    if http2 is None:
+        http2 = get_settings().http2_enabled
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(max_connections=1000, max_keepalive_connections=100),
+        timeout=httpx.Timeout(connect=3.0, read=10.0, write=5.0, pool=1.0),
+    )
+
+
+def make_timeout(read: float) -> httpx.Timeout:
+    """
+    建立單一目標的逾時設定
+
+    連線、寫入與等待連線池都應該很快完成，只有讀取 (等待對方處理) 依目標調整。
+
+    Args:
+        read: 讀取逾時 (秒)
+
+    Returns:
+        httpx.Timeout: 逾時設定
+    """
+    return httpx.Timeout(connect=2.0, read=read, write=2.0, pool=1.0)
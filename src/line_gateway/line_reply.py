@@ -3,29 +3,69 @@
 import logging
 
 import httpx
+import orjson
 
-from .config import get_settings
+from .config import get_runtime_settings
+from .http_clients import make_client, make_timeout
 
 logger = logging.getLogger(__name__)
 
 # LINE Messaging API 端點
 LINE_API_BASE = "https://api.line.me/v2/bot"
+LINE_INFO_URL = f"{LINE_API_BASE}/info"
+LINE_REPLY_URL = f"{LINE_API_BASE}/message/reply"
+LINE_PUSH_URL = f"{LINE_API_BASE}/message/push"
+
+# 通知訊息的固定內容
+NOTIFY_TITLE = "🎯 高價值客戶警報!"
+_JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class LineReplyService:
     """LINE 回覆服務 - 用於中繼站統一回覆模式"""
 
-    def __init__(self):
-        self.settings = get_settings()
-        self.client = httpx.AsyncClient(timeout=30.0)
+    def __init__(self, client: httpx.AsyncClient | None = None):
+        """
+        Args:
+            client: 共用的 HTTP client (未提供時自行建立)
+        """
+        self.settings = get_runtime_settings()
+        self._owns_client = client is None
+        self.client = client or make_client()
+        self.timeout = make_timeout(self.settings.line_reply_timeout_s)
+
+        # API 請求 Headers (token 啟動後不會改變，只建立一次)
+        self._headers = dict(_JSON_HEADERS)
+        if self.settings.line_channel_access_token:
+            self._headers["Authorization"] = (
+                f"Bearer {self.settings.line_channel_access_token}"
+            )
+
+    async def warm_up(self) -> bool:
+        """
+        預先建立到 LINE API 的連線 (DNS/TLS)，避免第一則回覆承擔連線成本
 
-    @property
-    def _headers(self) -> dict:
-        """取得 API 請求 Headers"""
-        return {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.settings.line_channel_access_token}",
-        }
+        Returns:
+            bool: 是否成功
+        """
+        if not self.settings.line_channel_access_token:
+            return False
+
+        try:
+            response = await self.client.get(
+                LINE_INFO_URL,
+                headers=self._headers,
+                timeout=self.timeout,
+            )
+            logger.info(
+                f"LINE API 連線已建立: status={response.status_code}, "
+                f"protocol={response.http_version}"
+            )
+            return response.status_code == 200
+
+        except httpx.RequestError as e:
+            logger.warning(f"LINE API 預熱失敗: {e}")
+            return False
 
     async def reply_text(self, reply_token: str, text: str) -> bool:
         """
@@ -68,16 +108,21 @@ class LineReplyService:
 
         try:
             response = await self.client.post(
-                f"{LINE_API_BASE}/message/reply",
+                LINE_REPLY_URL,
                 headers=self._headers,
-                json={
-                    "replyToken": reply_token,
-                    "messages": messages,
-                },
+                content=orjson.dumps(
+                    {
+                        "replyToken": reply_token,
+                        "messages": messages,
+                    }
+                ),
+                timeout=self.timeout,
             )
 
             if response.status_code == 200:
-                logger.debug(f"回覆成功: token={reply_token[:20]}...")
+                logger.debug(
+                    f"回覆成功: token={reply_token[:20]}..., protocol={response.http_version}"
+                )
                 return True
             else:
                 logger.error(
@@ -126,12 +171,15 @@ class LineReplyService:
 
         try:
             response = await self.client.post(
-                f"{LINE_API_BASE}/message/push",
+                LINE_PUSH_URL,
                 headers=self._headers,
-                json={
-                    "to": user_id,
-                    "messages": messages[:5],
-                },
+                content=orjson.dumps(
+                    {
+                        "to": user_id,
+                        "messages": messages[:5],
+                    }
+                ),
+                timeout=self.timeout,
             )
 
             if response.status_code == 200:
@@ -148,17 +196,52 @@ class LineReplyService:
             return False
 
     async def close(self):
-        """關閉 HTTP client"""
-        await self.client.aclose()
+        """關閉 HTTP client (共用的 client 由建立者負責關閉)"""
+        if self._owns_client:
+            await self.client.aclose()
+
+
+def _build_notify_payload(user_id: str, message_text: str, keyword: str) -> bytes:
+    """
+    建立高價值客戶通知的 JSON payload
+
+    同時包含 text (Discord / 自訂 Webhook) 與 blocks (Slack) 格式
+
+    Returns:
+        bytes: 序列化後的 JSON
+    """
+    return orjson.dumps(
+        {
+            "text": f"{NOTIFY_TITLE}\n關鍵字: {keyword}\n用戶ID: {user_id}\n訊息: {message_text}",
+            "blocks": [
+                {
+                    "type": "section",
+                    "text": {
+                        "type": "mrkdwn",
+                        "text": f"*{NOTIFY_TITLE}*\n"
+                        f"• 關鍵字: `{keyword}`\n"
+                        f"• 用戶ID: `{user_id}`\n"
+                        f"• 訊息: {message_text}",
+                    },
+                }
+            ],
+        }
+    )
 
 
 # 通知服務 - 用於高價值關鍵字觸發
 class NotifyService:
     """通知服務 - 當偵測到高價值關鍵字時發送通知"""
 
-    def __init__(self):
-        self.settings = get_settings()
-        self.client = httpx.AsyncClient(timeout=10.0)
+    def __init__(self, client: httpx.AsyncClient | None = None):
+        """
+        Args:
+            client: 共用的 HTTP client (未提供時自行建立)
+        """
+        self.settings = get_runtime_settings()
+        self._owns_client = client is None
+        self.client = client or make_client()
+        self.timeout = make_timeout(self.settings.notify_timeout_s)
 
     async def send_notification(
         self,
@@ -181,30 +264,11 @@ class NotifyService:
             return False
 
         try:
-            # 支援 Slack / Discord / 自訂 Webhook 格式
-            payload = {
-                "text": f"🎯 高價值客戶警報!\n"
-                f"關鍵字: {keyword}\n"
-                f"用戶ID: {user_id}\n"
-                f"訊息: {message_text}",
-                # Slack 格式
-                "blocks": [
-                    {
-                        "type": "section",
-                        "text": {
-                            "type": "mrkdwn",
-                            "text": f"*🎯 高價值客戶警報!*\n"
-                            f"• 關鍵字: `{keyword}`\n"
-                            f"• 用戶ID: `{user_id}`\n"
-                            f"• 訊息: {message_text}",
-                        },
-                    }
-                ],
-            }
-
             response = await self.client.post(
                 self.settings.notify_webhook_url,
-                json=payload,
+                content=_build_notify_payload(user_id, message_text, keyword),
+                headers=_JSON_HEADERS,
+                timeout=self.timeout,
             )
 
             return response.status_code == 200
@@ -214,26 +278,6 @@ class NotifyService:
             return False
 
     async def close(self):
-        """關閉 HTTP client"""
-        await self.client.aclose()
-
-
-# 模組層級實例
-_line_reply: LineReplyService | None = None
-_notify: NotifyService | None = None
-
-
-def get_line_reply_service() -> LineReplyService:
-    """取得 LINE 回覆服務實例"""
-    global _line_reply
-    if _line_reply is None:
-        _line_reply = LineReplyService()
-    return _line_reply
-
-
-def get_notify_service() -> NotifyService:
-    """取得通知服務實例"""
-    global _notify
-    if _notify is None:
-        _notify = NotifyService()
-    return _notify
+        """關閉 HTTP client (共用的 client 由建立者負責關閉)"""
+        if self._owns_client:
+            await self.client.aclose()
@@ -8,21 +8,25 @@ LINE Webhook Gateway - 中繼站主程式
 4. 統一回覆訊息 (避免 Reply Token 衝突)
 """
 
+import asyncio
+import base64
+import binascii
 import hashlib
 import hmac
-import base64
-import json
 import logging
 from contextlib import asynccontextmanager
+from dataclasses import dataclass
 
-from fastapi import FastAPI, Request, HTTPException, Header
+import orjson
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.responses import JSONResponse
 
-from .config import ReplyMode, get_settings
-from .forwarder import get_forwarder
-from .line_reply import get_line_reply_service, get_notify_service
-from .router import RouteTarget, route_message
-from .storage import save_conversation
+from . import storage
+from .config import ReplyMode, RuntimeSettings, get_runtime_settings, get_settings
+from .forwarder import WebhookForwarder, build_forward_headers
+from .http_clients import make_client
+from .line_reply import LineReplyService, NotifyService
+from .router import MessageRouter, RouteResult, RouteTarget
 
 # 設定 logging
 logging.basicConfig(
@@ -31,6 +35,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 背景處理中的事件 task (保留參照避免被 GC 回收)
+_background_tasks: set[asyncio.Task] = set()
+
+# 清除過期對話紀錄的間隔 (秒)
+_RETENTION_INTERVAL = 24 * 60 * 60
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -42,18 +52,46 @@ async def lifespan(app: FastAPI):
     logger.info(f"回覆模式: {settings.reply_mode.value}")
     logger.info(f"舊系統關鍵字: {settings.old_keywords_list}")
     logger.info(f"高價值關鍵字: {settings.high_value_keywords_list}")
+    logger.info(f"HTTP/2: {'啟用' if settings.http2_enabled else '停用'}")
     logger.info("=" * 50)
 
+    # 熱路徑使用的設定快照
+    app.state.rt = get_runtime_settings()
+
+    # 所有對外 HTTP 請求共用同一個 client
+    # 啟動時就建立所有服務，避免第一個 Webhook 承擔初始化成本
+    app.state.http = make_client(http2=settings.http2_enabled)
+    app.state.forwarder = WebhookForwarder(app.state.http)
+    app.state.line_reply = LineReplyService(app.state.http)
+    app.state.notify = NotifyService(app.state.http)
+    app.state.router = MessageRouter()
+    storage.init_storage()
+    await app.state.line_reply.warm_up()
+
+    # 每天清除一次過期的對話紀錄
+    retention_stop = asyncio.Event()
+    retention_task = None
+    if settings.conversation_retention_days > 0:
+        retention_task = asyncio.create_task(
+            _retention_loop(settings.conversation_retention_days, retention_stop)
+        )
+
     yield
 
     # 關閉時
     logger.info("正在關閉服務...")
-    forwarder = get_forwarder()
-    await forwarder.close()
-    line_reply = get_line_reply_service()
-    await line_reply.close()
-    notify = get_notify_service()
-    await notify.close()
+    # 等進行中的清除完成再關閉資料庫
+    if retention_task is not None:
+        retention_stop.set()
+        await retention_task
+    # 等待背景事件處理完成，再關閉 HTTP client
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+    await app.state.forwarder.close()
+    await app.state.line_reply.close()
+    await app.state.notify.close()
+    await app.state.http.aclose()
+    await storage.close_storage()
 
 
 app = FastAPI(
@@ -64,15 +102,67 @@ app = FastAPI(
 )
 
 
-def verify_signature(body: bytes, signature: str, channel_secret: str) -> bool:
-    """驗證 LINE Webhook 簽名"""
-    hash_value = hmac.new(
-        channel_secret.encode("utf-8"),
-        body,
-        hashlib.sha256,
-    ).digest()
-    expected_signature = base64.b64encode(hash_value).decode("utf-8")
-    return hmac.compare_digest(signature, expected_signature)
+def get_runtime(request: Request) -> RuntimeSettings:
+    """取得執行期設定"""
+    return request.app.state.rt
+
+
+def get_router(request: Request) -> MessageRouter:
+    """取得路由器實例"""
+    return request.app.state.router
+
+
+def get_forwarder(request: Request) -> WebhookForwarder:
+    """取得轉發器實例"""
+    return request.app.state.forwarder
+
+
+def get_line_reply_service(request: Request) -> LineReplyService:
+    """取得 LINE 回覆服務實例"""
+    return request.app.state.line_reply
+
+
+def get_notify_service(request: Request) -> NotifyService:
+    """取得通知服務實例"""
+    return request.app.state.notify
+
+
+@dataclass(frozen=True)
+class EventServices:
+    """處理事件需要的服務"""
+
+    rt: RuntimeSettings
+    router: MessageRouter
+    forwarder: WebhookForwarder
+    line_reply: LineReplyService
+    notify: NotifyService
+
+
+def get_event_services(
+    rt: RuntimeSettings = Depends(get_runtime),
+    router: MessageRouter = Depends(get_router),
+    forwarder: WebhookForwarder = Depends(get_forwarder),
+    line_reply: LineReplyService = Depends(get_line_reply_service),
+    notify: NotifyService = Depends(get_notify_service),
+) -> EventServices:
+    """組合處理事件需要的服務 (可在測試中透過 dependency_overrides 替換)"""
+    return EventServices(
+        rt=rt,
+        router=router,
+        forwarder=forwarder,
+        line_reply=line_reply,
+        notify=notify,
+    )
+
+
+def verify_signature(body: bytes, signature: str, channel_secret: bytes) -> bool:
+    """驗證 LINE Webhook 簽名 (直接比對 HMAC digest，不需再做 base64 編碼)"""
+    expected = hmac.new(channel_secret, body, hashlib.sha256).digest()
+    try:
+        provided = base64.b64decode(signature, validate=True)
+    except (binascii.Error, ValueError):
+        return False
+    return hmac.compare_digest(expected, provided)
 
 
 @app.get("/")
@@ -91,44 +181,69 @@ async def health():
 async def webhook(
     request: Request,
     x_line_signature: str = Header(None, alias="X-Line-Signature"),
+    services: EventServices = Depends(get_event_services),
 ):
     """
     LINE Webhook 主要端點
 
     這是所有 LINE 事件的唯一入口
     """
-    settings = get_settings()
+    settings = request.app.state.rt
 
     # 取得原始 body
     body = await request.body()
 
-    # 驗證簽名 (如果有設定 channel secret)
-    if settings.line_channel_secret and x_line_signature:
-        if not verify_signature(body, x_line_signature, settings.line_channel_secret):
+    # 驗證簽名 (如果有設定 channel secret，就必須帶簽名)
+    if settings.line_channel_secret_bytes:
+        if not x_line_signature:
+            logger.warning("Webhook 缺少簽名")
+            raise HTTPException(status_code=403, detail="Missing signature")
+        if not verify_signature(body, x_line_signature, settings.line_channel_secret_bytes):
             logger.warning("Webhook 簽名驗證失敗")
             raise HTTPException(status_code=403, detail="Invalid signature")
 
     # 解析 JSON
     try:
-        data = json.loads(body)
-    except json.JSONDecodeError:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
         logger.error("無法解析 Webhook JSON")
         raise HTTPException(status_code=400, detail="Invalid JSON")
 
-    # 處理每個事件
+    # 事件改在背景處理，先回應 LINE，避免後端延遲拖慢 Webhook 回應
     events = data.get("events", [])
-
-    for event in events:
-        await process_event(event, body, dict(request.headers))
+    if events:
+        headers = build_forward_headers(request.headers.raw)
+        task = asyncio.create_task(process_events(events, body, headers, services))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
 
     # LINE 要求回傳 200 OK
     return JSONResponse(content={"status": "ok"}, status_code=200)
 
 
-async def process_event(event: dict, raw_body: bytes, headers: dict):
-    """處理單一事件"""
-    settings = get_settings()
+async def process_events(
+    events: list[dict],
+    raw_body: bytes,
+    headers: dict,
+    services: EventServices,
+):
+    """同時處理同一批 Webhook 的所有事件 (單一事件失敗不影響其他事件)"""
+    results = await asyncio.gather(
+        *[process_event(event, raw_body, headers, services) for event in events],
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"處理事件失敗: {result}")
+
 
+async def process_event(
+    event: dict,
+    raw_body: bytes,
+    headers: dict,
+    services: EventServices,
+):
+    """處理單一事件"""
     event_type = event.get("type", "unknown")
     reply_token = event.get("replyToken")
 
@@ -147,12 +262,13 @@ async def process_event(event: dict, raw_body: bytes, headers: dict):
     )
 
     # 第一步：路由判斷
-    route_result = route_message(message_text, message_type)
+    route_result = services.router.route(message_text, message_type)
     logger.info(f"路由結果: target={route_result.target.value}, reason={route_result.reason}")
 
-    # 第二步：儲存對話紀錄 (非常重要！這是訓練 AI 的珍貴數據)
-    try:
-        await save_conversation(
+    # 第二步~第四步互不依賴，同時進行
+    steps = [
+        # 儲存對話紀錄 (非常重要！這是訓練 AI 的珍貴數據)
+        _safe_save(
             user_id=user_id,
             event_type=event_type,
             message_type=message_type,
@@ -161,25 +277,83 @@ async def process_event(event: dict, raw_body: bytes, headers: dict):
             raw_event=event,
             route_target=route_result.target.value,
             route_reason=route_result.reason,
-        )
-    except Exception as e:
-        logger.error(f"儲存對話失敗: {e}")
-        # 不要因為儲存失敗而影響主流程
+        ),
+        # 轉發並回覆
+        _safe_dispatch(route_result, reply_token, raw_body, headers, services),
+    ]
 
-    # 第三步：如果是高價值關鍵字，發送通知
+    # 如果是高價值關鍵字，發送通知
     if route_result.is_high_value and route_result.matched_keyword:
-        try:
-            notify = get_notify_service()
-            await notify.send_notification(
+        steps.append(
+            _safe_notify(
+                services.notify,
                 user_id=user_id,
                 message_text=message_text or "",
                 keyword=route_result.matched_keyword,
             )
+        )
+
+    await asyncio.gather(*steps)
+
+
+async def _retention_loop(days: int, stop: asyncio.Event):
+    """定期刪除超過保留天數的對話紀錄，直到 stop 被設定"""
+    while not stop.is_set():
+        try:
+            await storage.STORAGE.purge_before(days)
         except Exception as e:
-            logger.error(f"發送通知失敗: {e}")
+            logger.error(f"清除過期對話紀錄失敗: {e}")
+
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=_RETENTION_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _safe_save(**fields):
+    """儲存對話紀錄 (失敗只記錄錯誤，不要因為儲存失敗而影響主流程)"""
+    try:
+        await storage.save_conversation(**fields)
+    except Exception as e:
+        logger.error(f"儲存對話失敗: {e}")
+
+
+async def _safe_dispatch(
+    route_result: RouteResult,
+    reply_token: str | None,
+    raw_body: bytes,
+    headers: dict,
+    services: EventServices,
+):
+    """轉發並回覆 (失敗只記錄錯誤，不影響儲存與通知)"""
+    try:
+        await dispatch_event(route_result, reply_token, raw_body, headers, services)
+    except Exception as e:
+        logger.error(f"轉發事件失敗: {e}")
+
+
+async def _safe_notify(notify: NotifyService, user_id: str, message_text: str, keyword: str):
+    """發送高價值客戶通知 (失敗只記錄錯誤，不影響主流程)"""
+    try:
+        await notify.send_notification(
+            user_id=user_id,
+            message_text=message_text,
+            keyword=keyword,
+        )
+    except Exception as e:
+        logger.error(f"發送通知失敗: {e}")
+
 
-    # 第四步：根據回覆模式處理
-    forwarder = get_forwarder()
+async def dispatch_event(
+    route_result: RouteResult,
+    reply_token: str | None,
+    raw_body: bytes,
+    headers: dict,
+    services: EventServices,
+):
+    """根據回覆模式轉發事件，必要時由中繼站回覆"""
+    settings = services.rt
+    forwarder = services.forwarder
 
     if settings.reply_mode == ReplyMode.UNIFIED:
         # 統一回覆模式：中繼站負責回覆
@@ -191,8 +365,7 @@ async def process_event(event: dict, raw_body: bytes, headers: dict):
                 # 如果後端系統回傳了要回覆的訊息
                 response_text = result.response_body.get("reply_text")
                 if response_text and reply_token:
-                    line_reply = get_line_reply_service()
-                    await line_reply.reply_text(reply_token, response_text)
+                    await services.line_reply.reply_text(reply_token, response_text)
                     break  # Reply token 只能用一次
 
     elif settings.reply_mode == ReplyMode.DELEGATE_OLD:
@@ -215,6 +388,8 @@ async def process_event(event: dict, raw_body: bytes, headers: dict):
 
 # 開發模式入口
 if __name__ == "__main__":
+    import sys
+
     import uvicorn
 
     settings = get_settings()
@@ -223,4 +398,7 @@ if __name__ == "__main__":
         host=settings.host,
         port=settings.port,
         reload=settings.debug,
+        # uvloop 不支援 Windows，改用標準 asyncio event loop
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
     )
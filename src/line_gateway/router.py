@@ -3,7 +3,13 @@
 from dataclasses import dataclass
 from enum import Enum
 
-from .config import get_settings
+import ahocorasick
+
+from .config import get_runtime_settings
+
+# 關鍵字類別 (Aho-Corasick 自動機中的標記)
+_OLD = "old"
+_HIGH_VALUE = "high_value"
 
 
 class RouteTarget(str, Enum):
@@ -14,9 +20,9 @@ class RouteTarget(str, Enum):
     BOTH = "both"  # 兩邊都轉發 (例如：需要紀錄但由新系統回覆)
 
 
-@dataclass
+@dataclass(frozen=True)
 class RouteResult:
-    """路由結果"""
+    """路由結果 (不可變，可安全地重複使用同一個實例)"""
 
     target: RouteTarget
     reason: str
@@ -28,7 +34,31 @@ class MessageRouter:
     """訊息路由器 - 決定訊息該送往哪個系統"""
 
     def __init__(self):
-        self.settings = get_settings()
+        self.settings = get_runtime_settings()
+        self._old_keywords = self.settings.old_keywords_list
+        self._high_value_keywords = self.settings.high_value_keywords_list
+        self._automaton = self._build_automaton()
+        # 非文字事件的路由結果固定，依訊息類型快取
+        self._non_text_results: dict[str, RouteResult] = {}
+
+    def _build_automaton(self) -> ahocorasick.Automaton | None:
+        """
+        將所有關鍵字建成單一 Aho-Corasick 自動機
+
+        不論關鍵字數量多少，每則訊息只需掃描一次。
+        同一個關鍵字同時出現在兩份清單時，以舊系統關鍵字優先。
+        """
+        automaton = ahocorasick.Automaton()
+        for keyword in self._high_value_keywords:
+            automaton.add_word(keyword, (_HIGH_VALUE, keyword))
+        for keyword in self._old_keywords:
+            automaton.add_word(keyword, (_OLD, keyword))
+
+        if len(automaton) == 0:
+            return None
+
+        automaton.make_automaton()
+        return automaton
 
     def route(self, message_text: str | None, message_type: str = "text") -> RouteResult:
         """
@@ -43,30 +73,36 @@ class MessageRouter:
         """
         # 非文字訊息 -> 預設轉發給新系統處理
         if message_type != "text" or message_text is None:
+            result = self._non_text_results.get(message_type)
+            if result is None:
+                result = RouteResult(
+                    target=RouteTarget.NEW_SYSTEM,
+                    reason=f"非文字訊息 (type={message_type})，由新系統處理",
+                )
+                self._non_text_results[message_type] = result
+            return result
+
+        # 一次掃描找出所有關鍵字：舊系統關鍵字優先，其次為高價值關鍵字
+        high_value_keyword = None
+        if self._automaton is not None:
+            for _, (kind, keyword) in self._automaton.iter(message_text):
+                if kind == _OLD:
+                    return RouteResult(
+                        target=RouteTarget.OLD_SYSTEM,
+                        reason=f"包含舊系統關鍵字: {keyword}",
+                        matched_keyword=keyword,
+                    )
+                if high_value_keyword is None:
+                    high_value_keyword = keyword
+
+        if high_value_keyword is not None:
             return RouteResult(
                 target=RouteTarget.NEW_SYSTEM,
-                reason=f"非文字訊息 (type={message_type})，由新系統處理",
+                reason=f"包含高價值關鍵字: {high_value_keyword}",
+                is_high_value=True,
+                matched_keyword=high_value_keyword,
             )
 
-        # 檢查是否包含舊系統關鍵字
-        for keyword in self.settings.old_keywords_list:
-            if keyword in message_text:
-                return RouteResult(
-                    target=RouteTarget.OLD_SYSTEM,
-                    reason=f"包含舊系統關鍵字: {keyword}",
-                    matched_keyword=keyword,
-                )
-
-        # 檢查是否為高價值關鍵字
-        for keyword in self.settings.high_value_keywords_list:
-            if keyword in message_text:
-                return RouteResult(
-                    target=RouteTarget.NEW_SYSTEM,
-                    reason=f"包含高價值關鍵字: {keyword}",
-                    is_high_value=True,
-                    matched_keyword=keyword,
-                )
-
         # 預設 -> 新系統
         return RouteResult(
             target=RouteTarget.NEW_SYSTEM,
@@ -80,20 +116,3 @@ class MessageRouter:
     def should_forward_to_new(self, route_result: RouteResult) -> bool:
         """是否應該轉發給新系統"""
         return route_result.target in (RouteTarget.NEW_SYSTEM, RouteTarget.BOTH)
-
-
-# 模組層級的便捷函數
-_router: MessageRouter | None = None
-
-
-def get_router() -> MessageRouter:
-    """取得路由器實例 (單例模式)"""
-    global _router
-    if _router is None:
-        _router = MessageRouter()
-    return _router
-
-
-def route_message(message_text: str | None, message_type: str = "text") -> RouteResult:
-    """便捷函數 - 路由訊息"""
-    return get_router().route(message_text, message_type)
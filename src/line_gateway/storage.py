@@ -1,17 +1,252 @@
 """資料存儲模組 - 記錄所有對話，作為 AI 訓練的珍貴數據"""
 
-import json
+import asyncio
+import itertools
 import logging
 import sqlite3
+import time
 from abc import ABC, abstractmethod
-from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import Any, Awaitable, Callable, Iterable, Iterator
+
+import orjson
+import zstandard
 
 from .config import DatabaseType, get_settings
 
 logger = logging.getLogger(__name__)
 
+# 批次寫入設定：累積最多 batch_size 筆，或等待 _FLUSH_INTERVAL 秒後寫入一次
+_BATCH_SIZE = 200
+_FIRESTORE_BATCH_SIZE = 500  # Firestore 單一 batch 最多 500 個寫入
+_FLUSH_INTERVAL = 0.05
+# 佇列最多暫存的筆數，寫入跟不上時 save_event 會等待 (backpressure)，避免記憶體無限成長
+_MAX_PENDING = 10_000
+# 寫入失敗時的重試次數與第一次重試前的等待時間 (秒，之後每次加倍)
+_WRITE_ATTEMPTS = 3
+_RETRY_DELAY = 0.1
+
+
+async def _call_with_retries(
+    func: Callable[..., Awaitable[Any]],
+    *args: Any,
+    retry_on: tuple[type[BaseException], ...] = (Exception,),
+    attempts: int = _WRITE_ATTEMPTS,
+    delay: float | None = None,
+) -> Any:
+    """
+    呼叫 func，遇到 retry_on 例外時以指數退避重試；最後一次仍失敗就拋出例外
+
+    delay 為第一次重試前的等待時間 (秒)，未指定時使用 _RETRY_DELAY
+    """
+    if delay is None:
+        delay = _RETRY_DELAY
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func(*args)
+        except retry_on as e:
+            if attempt == attempts:
+                raise
+            wait = delay * 2 ** (attempt - 1)
+            logger.warning(f"寫入失敗，{wait:.2f} 秒後重試 ({attempt}/{attempts}): {e}")
+            await asyncio.sleep(wait)
+
+# 所有寫入都使用同一個 SQL 字串，連線的 statement cache 會重複使用同一個 prepared statement
+_INSERT_SQL = """
+    INSERT INTO conversations
+    (event_id, user_id, event_type, message_type, message_text,
+     reply_token, route_target, route_reason, raw_event)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+_INSERT_OR_IGNORE_SQL = _INSERT_SQL.replace("INSERT", "INSERT OR IGNORE", 1)
+
+# 記憶體資料庫 (開發測試用，不寫入磁碟，需要時以 snapshot() 另存)
+_MEMORY_DB = ":memory:"
+
+# 多列 INSERT 每個語句最多的列數 (9 欄 x 100 列 = 900 個參數，低於舊版 SQLite 的 999 上限)
+_ROWS_PER_STATEMENT = 100
+
+
+@lru_cache(maxsize=32)
+def _multi_insert_sql(row_count: int) -> str:
+    """產生一次寫入 row_count 列的 INSERT 語句 (依列數快取)"""
+    values = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?)"] * row_count)
+    return _INSERT_SQL.replace("(?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+
+
+# 清除過期紀錄時每次刪除的筆數，每段之間釋放連線鎖，讓批次寫入不會被長時間卡住
+_PURGE_CHUNK_SIZE = 5000
+_PURGE_CHUNK_SQL = """
+    DELETE FROM conversations
+    WHERE id IN (
+        SELECT id FROM conversations
+        WHERE created_at < datetime('now', ?)
+        LIMIT ?
+    )
+"""
+
+# PRAGMA auto_vacuum 的值: 0 = NONE, 1 = FULL, 2 = INCREMENTAL
+_AUTO_VACUUM_INCREMENTAL = 2
+
+# bulk_import 每次建立並寫入的筆數 (避免整批事件同時壓縮後放在記憶體中)
+_IMPORT_CHUNK_SIZE = 1000
+
+# 次要索引 (名稱, 建立語法)，bulk_import 會暫時移除後再重建
+_SECONDARY_INDEXES = (
+    (
+        # (user_id, created_at DESC) 讓使用者歷史查詢可以直接依序讀取，不需額外排序
+        "idx_user_created",
+        "CREATE INDEX IF NOT EXISTS idx_user_created ON conversations(user_id, created_at DESC)",
+    ),
+    (
+        "idx_created_at",
+        "CREATE INDEX IF NOT EXISTS idx_created_at ON conversations(created_at)",
+    ),
+)
+
+# 對話歷史預設只取這些欄位；raw_event 可能有數 KB，只在需要時才讀取
+_HISTORY_COLUMNS = (
+    "id",
+    "event_id",
+    "user_id",
+    "event_type",
+    "message_type",
+    "message_text",
+    "reply_token",
+    "route_target",
+    "route_reason",
+    "created_at",
+)
+# Firestore 的 event_id 是文件 ID (不是欄位)，也沒有自動遞增的 id，查詢時只選其他欄位
+_FIRESTORE_HISTORY_FIELDS = tuple(c for c in _HISTORY_COLUMNS if c not in ("id", "event_id"))
+_HISTORY_SQL = """
+    SELECT {columns}
+    FROM conversations
+    WHERE user_id = ?
+    ORDER BY created_at DESC
+    LIMIT ?
+"""
+_HISTORY_SELECT_SQL = _HISTORY_SQL.format(columns=", ".join(_HISTORY_COLUMNS))
+_HISTORY_WITH_RAW_SELECT_SQL = _HISTORY_SQL.format(
+    columns=", ".join(_HISTORY_COLUMNS + ("decode_raw_event(raw_event) AS raw_event",))
+)
+
+
+def _make_event_id(user_id: str, raw_event: dict | None, seq: Iterator[int]) -> str:
+    """
+    產生事件 ID
+
+    有 LINE 的 webhookEventId 時使用 {user_id}_{webhookEventId}，
+    同一個事件重送、或之後用 bulk_import 重播時都會得到相同的 ID，可依 ID 略過重複；
+    沒有時使用遞增序號 {user_id}_{序號}。
+    """
+    webhook_event_id = raw_event.get("webhookEventId") if raw_event else None
+    if webhook_event_id:
+        return f"{user_id}_{webhook_event_id}"
+    return f"{user_id}_{next(seq)}"
+
+
+class _WriteQueue:
+    """批次寫入佇列 - 事件先放入佇列，由背景 task 累積成批後一次寫入"""
+
+    __slots__ = (
+        "_write_batch",
+        "_batch_size",
+        "_flush_interval",
+        "_retry_delay",
+        "_pending",
+        "_task",
+    )
+
+    def __init__(
+        self,
+        write_batch: Callable[[list], Awaitable[None]],
+        batch_size: int,
+        flush_interval: float = _FLUSH_INTERVAL,
+        max_pending: int = _MAX_PENDING,
+        retry_delay: float | None = None,
+    ):
+        """
+        Args:
+            write_batch: 寫入一批資料的 coroutine function
+            batch_size: 每批最多筆數
+            flush_interval: 佇列不滿一批時，等待更多資料的時間 (秒)
+            max_pending: 佇列最多暫存的筆數，滿了之後 put 會等待
+            retry_delay: 寫入失敗後第一次重試前的等待時間 (秒，未指定時使用 _RETRY_DELAY)
+        """
+        self._write_batch = write_batch
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._retry_delay = retry_delay
+        # None 代表停止
+        self._pending: asyncio.Queue[Any | None] = asyncio.Queue(maxsize=max_pending)
+        self._task: asyncio.Task | None = None
+
+    async def put(self, item: Any):
+        """放入一筆待寫入的資料 (第一次呼叫時啟動背景 task；佇列已滿時等待)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        if self._pending.full():
+            logger.warning(f"寫入佇列已滿 ({self._pending.maxsize} 筆)，等待背景寫入")
+        await self._pending.put(item)
+
+    async def _run(self):
+        """背景 task - 持續從佇列取出資料並批次寫入"""
+        while True:
+            item = await self._pending.get()
+            if item is None:
+                return
+            batch = [item]
+
+            # 佇列還不滿一批時，稍等一下讓同一波的資料一起寫入
+            if self._pending.qsize() < self._batch_size - 1:
+                await asyncio.sleep(self._flush_interval)
+
+            stop = False
+            while len(batch) < self._batch_size and not self._pending.empty():
+                item = self._pending.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+            if stop:
+                return
+
+    async def _flush(self, batch: list):
+        """
+        寫入一批資料
+
+        失敗時先以指數退避重試整批；仍然失敗就改為逐筆寫入，只捨棄寫不進去的那幾筆。
+        """
+        try:
+            await _call_with_retries(self._write_batch, batch, delay=self._retry_delay)
+            return
+        except Exception as e:
+            if len(batch) == 1:
+                logger.error(f"寫入失敗，捨棄 1 筆: {e}")
+                return
+            logger.error(f"批次寫入 {len(batch)} 筆失敗，改為逐筆寫入: {e}")
+
+        dropped = 0
+        for item in batch:
+            try:
+                await self._write_batch([item])
+            except Exception as e:
+                dropped += 1
+                logger.error(f"寫入失敗，捨棄 1 筆: {e}")
+        if dropped:
+            logger.error(f"批次寫入共捨棄 {dropped} / {len(batch)} 筆")
+
+    async def close(self):
+        """寫入佇列中剩餘的資料後停止背景 task"""
+        if self._task is not None and not self._task.done():
+            await self._pending.put(None)
+            await self._task
+
 
 class ConversationStorage(ABC):
     """對話存儲抽象基類"""
@@ -38,11 +273,36 @@ class ConversationStorage(ABC):
 
     @abstractmethod
     async def get_user_history(
-        self, user_id: str, limit: int = 50
-    ) -> list[dict]:
-        """取得使用者對話歷史"""
+        self, user_id: str, limit: int = 50, include_raw: bool = False
+    ) -> list[Any]:
+        """
+        取得使用者對話歷史
+
+        Args:
+            user_id: 使用者 ID
+            limit: 最多筆數
+            include_raw: 是否包含原始事件 raw_event (較大，預設不取)
+
+        Returns:
+            list: 對話紀錄 (依實作不同為 dict 或 sqlite3.Row，皆可用 record["欄位"] 取值)
+        """
         pass
 
+    async def purge_before(self, days: int) -> int:
+        """
+        刪除超過保留天數的對話紀錄 (預設不支援，回傳 0)
+
+        Args:
+            days: 保留天數
+
+        Returns:
+            int: 刪除的筆數
+        """
+        return 0
+
+    async def close(self):
+        """釋放資源 (例如資料庫連線)"""
+
 
 class SQLiteStorage(ConversationStorage):
     """SQLite 存儲實現 - 適合開發測試與小規模使用"""
@@ -52,13 +312,60 @@ class SQLiteStorage(ConversationStorage):
         if db_path.startswith("sqlite:///"):
             db_path = db_path.replace("sqlite:///", "")
 
-        self.db_path = Path(db_path)
+        # :memory: 不是檔案路徑，直接交給 sqlite3
+        self.db_path = db_path if db_path == _MEMORY_DB else Path(db_path)
+
+        # 整個 storage 共用一條長連線 (SQLite 的寫入本來就是序列化的)
+        # 事件 ID 序號：從啟動時間 (ns) 開始遞增，同一瞬間的多個事件也不會重複
+        self._seq = itertools.count(time.time_ns())
+
+        # raw_event 以 zstd 壓縮後存成 BLOB，減少磁碟與 page cache 用量
+        self._compressor = zstandard.ZstdCompressor(level=3)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+        self._conn = self._connect()
+        self._lock = asyncio.Lock()
         self._init_db()
 
+        # 待寫入的事件，由背景 task 批次寫入
+        self._queue = _WriteQueue(self._write_batch, batch_size=_BATCH_SIZE)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        開啟資料庫連線並套用連線層級的 PRAGMA
+
+        journal_mode=WAL 會寫入資料庫檔案 (只需在初始化時設定一次)，
+        其餘 PRAGMA 只對目前連線有效，每個新連線都要重新設定。
+        """
+        # isolation_level=None: 自動 commit，每個 INSERT 自成一個交易
+        # cached_statements: 保留較多 prepared statement，避免重複解析 SQL
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            isolation_level=None,
+            cached_statements=256,
+        )
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL 模式下 NORMAL 已足夠安全
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")  # 約 64MB page cache
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA foreign_keys=ON")
+        # 查詢時在 SQLite 內直接還原 raw_event，結果列不需再複製成 dict 處理
+        conn.create_function(
+            "decode_raw_event", 1, self._decode_raw_event, deterministic=True
+        )
+        return conn
+
     def _init_db(self):
         """初始化資料庫表結構"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        cursor = self._conn.cursor()
+
+        # INCREMENTAL: 刪除紀錄後可由 purge_before 逐步歸還空間，讓資料庫大小維持在 page cache 內
+        # (必須在建立資料表前設定；既有的資料庫需 VACUUM 一次才會生效)
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+
+        # WAL: 寫入不會阻擋讀取，且每次 commit 不需要額外的 fsync
+        cursor.execute("PRAGMA journal_mode=WAL")
 
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS conversations (
@@ -71,21 +378,20 @@ class SQLiteStorage(ConversationStorage):
                 reply_token TEXT,
                 route_target TEXT,
                 route_reason TEXT,
-                raw_event TEXT,
+                raw_event BLOB,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
 
         # 建立索引加速查詢
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_user_id ON conversations(user_id)
-        """)
-        cursor.execute("""
-            CREATE INDEX IF NOT EXISTS idx_created_at ON conversations(created_at)
-        """)
+        cursor.execute("DROP INDEX IF EXISTS idx_user_id")  # 已被 idx_user_created 取代
+        for _, create_sql in _SECONDARY_INDEXES:
+            cursor.execute(create_sql)
+
+        # 既有的資料庫不會套用上面的 auto_vacuum 設定 (purge_before 時會提醒)
+        (self._auto_vacuum,) = cursor.execute("PRAGMA auto_vacuum").fetchone()
 
-        conn.commit()
-        conn.close()
+        cursor.close()
 
         logger.info(f"SQLite 資料庫已初始化: {self.db_path}")
 
@@ -100,63 +406,262 @@ class SQLiteStorage(ConversationStorage):
         route_target: str | None = None,
         route_reason: str | None = None,
     ) -> str:
-        """儲存事件到 SQLite"""
-        event_id = f"{user_id}_{datetime.now().timestamp()}"
+        """
+        儲存事件到 SQLite
+
+        事件先放入佇列後立即回傳，由背景 task 在同一個交易中批次寫入，
+        讓一次 fsync 分攤到整批事件。
+        """
+        params = self._build_row(
+            user_id=user_id,
+            event_type=event_type,
+            message_type=message_type,
+            message_text=message_text,
+            reply_token=reply_token,
+            raw_event=raw_event,
+            route_target=route_target,
+            route_reason=route_reason,
+        )
+
+        await self._queue.put(params)
+
+        return params[0]
+
+    def _build_row(
+        self,
+        user_id: str,
+        event_type: str,
+        message_type: str | None,
+        message_text: str | None,
+        reply_token: str | None,
+        raw_event: dict,
+        route_target: str | None = None,
+        route_reason: str | None = None,
+        *,
+        event_id: str | None = None,
+        compressor: zstandard.ZstdCompressor | None = None,
+    ) -> tuple:
+        """
+        建立一筆 INSERT 參數 (第一個欄位為事件 ID)
+
+        Args:
+            event_id: 指定事件 ID (未指定時由 _make_event_id 產生)
+            compressor: 壓縮 raw_event 使用的 compressor (在其他執行緒建立列時需另外提供)
+        """
+        if event_id is None:
+            event_id = _make_event_id(user_id, raw_event, self._seq)
+        compressor = compressor or self._compressor
+        return (
+            event_id,
+            user_id,
+            event_type,
+            message_type,
+            message_text,
+            reply_token,
+            route_target,
+            route_reason,
+            compressor.compress(orjson.dumps(raw_event)),
+        )
+
+    async def bulk_import(self, events: Iterable[dict]) -> int:
+        """
+        大量匯入事件 (例如重播 log、匯入訓練資料)，不適用於即時 Webhook
+
+        匯入期間暫時移除次要索引，全部寫入後再重建，
+        避免每筆 INSERT 都要維護索引。整個過程在同一個交易中完成，
+        失敗時完整回滾 (包含索引)。事件在背景執行緒中分段建立與寫入，
+        不會佔用 event loop，也不需要一次把整批壓縮後的資料放在記憶體中。
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        注意：整個匯入期間都持有連線鎖 (交易與移除的索引不能和即時寫入共用)，
+        即時事件會留在寫入佇列中等待、佇列滿了之後 save_event 也會等待，
+        get_user_history 同樣會等到匯入結束。請在離峰時段或另一個資料庫檔案上執行大量匯入。
 
+        事件 ID 取自事件的 event_id 欄位；沒有時與 save_event 相同，
+        使用 raw_event 中 LINE 的 webhookEventId (組成 {user_id}_{webhookEventId})。
+        ID 已存在的事件 (包含之前即時儲存過的事件) 會被略過，
+        因此重播 log 不會產生重複紀錄。
+
+        Args:
+            events: 事件列表，每筆的 key 與 save_event 的參數相同，可另外帶 event_id
+
+        Returns:
+            int: 實際寫入的筆數 (已存在的事件不計入)
+        """
+        async with self._lock:
+            return await asyncio.to_thread(self._bulk_insert, events)
+
+    def _bulk_insert(self, events: Iterable[dict]) -> int:
+        """移除索引 -> 分段建立並寫入 -> 重建索引 (同步，於背景執行緒執行)"""
+        # save_event 會在 event loop 上同時使用 self._compressor，這裡另外建立一個
+        compressor = zstandard.ZstdCompressor(level=3)
+        conn = self._conn
+        events = iter(events)
+        total = 0
         try:
-            cursor.execute(
-                """
-                INSERT INTO conversations
-                (event_id, user_id, event_type, message_type, message_text,
-                 reply_token, route_target, route_reason, raw_event)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """,
-                (
-                    event_id,
-                    user_id,
-                    event_type,
-                    message_type,
-                    message_text,
-                    reply_token,
-                    route_target,
-                    route_reason,
-                    json.dumps(raw_event, ensure_ascii=False),
-                ),
-            )
-            conn.commit()
+            conn.execute("BEGIN IMMEDIATE")
+            for name, _ in _SECONDARY_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+            before = conn.total_changes
+            while chunk := list(itertools.islice(events, _IMPORT_CHUNK_SIZE)):
+                rows = [self._build_import_row(event, compressor) for event in chunk]
+                conn.executemany(_INSERT_OR_IGNORE_SQL, rows)
+                total += len(rows)
+            inserted = conn.total_changes - before
+
+            for _, create_sql in _SECONDARY_INDEXES:
+                conn.execute(create_sql)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+        logger.info(f"已匯入 {inserted} / {total} 筆事件")
+        return inserted
+
+    def _build_import_row(self, event: dict, compressor: zstandard.ZstdCompressor) -> tuple:
+        """建立一筆匯入事件的 INSERT 參數 (可由事件的 event_id 欄位指定 ID)"""
+        fields = dict(event)
+        event_id = fields.pop("event_id", None)
+        return self._build_row(**fields, event_id=event_id, compressor=compressor)
+
+    async def _write_batch(self, rows: list[tuple]):
+        """寫入一批事件 (由批次寫入佇列呼叫)"""
+        async with self._lock:
+            await asyncio.to_thread(self._insert_many, rows)
+
+    def _insert_many(self, rows: list[tuple]):
+        """在單一交易中寫入多筆事件 (同步，於背景執行緒執行)"""
+        try:
+            # BEGIN IMMEDIATE: 一開始就取得寫入鎖，避免交易中途升級鎖時發生 SQLITE_BUSY
+            self._conn.execute("BEGIN IMMEDIATE")
+            # 以多列 VALUES 一次寫入，減少逐列執行語句的開銷
+            for start in range(0, len(rows), _ROWS_PER_STATEMENT):
+                chunk = rows[start : start + _ROWS_PER_STATEMENT]
+                self._conn.execute(
+                    _multi_insert_sql(len(chunk)),
+                    list(itertools.chain.from_iterable(chunk)),
+                )
+            self._conn.execute("COMMIT")
+            logger.debug(f"已批次儲存 {len(rows)} 筆事件")
+        except sqlite3.IntegrityError:
+            # 有重複的事件時整批回滾，改為逐筆寫入，只略過重複的那幾筆
+            self._conn.execute("ROLLBACK")
+            for params in rows:
+                self._insert(params)
+        except sqlite3.Error:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+            raise
+
+    def _insert(self, params: tuple):
+        """寫入單筆事件 (同步，於背景執行緒執行)"""
+        event_id = params[0]
+        try:
+            self._conn.execute(_INSERT_SQL, params)
             logger.debug(f"已儲存事件: {event_id}")
-            return event_id
         except sqlite3.IntegrityError:
             logger.warning(f"事件已存在: {event_id}")
-            return event_id
-        finally:
-            conn.close()
 
     async def get_user_history(
-        self, user_id: str, limit: int = 50
-    ) -> list[dict]:
-        """取得使用者對話歷史"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT * FROM conversations
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT ?
-            """,
-            (user_id, limit),
-        )
+        self, user_id: str, limit: int = 50, include_raw: bool = False
+    ) -> list[sqlite3.Row]:
+        """
+        取得使用者對話歷史 (還在佇列中、尚未寫入的事件不會出現在結果中)
 
+        回傳 sqlite3.Row，可用 row["欄位"] 取值；需要 dict 時再自行 dict(row)。
+        """
+        async with self._lock:
+            return await asyncio.to_thread(
+                self._select_history, user_id, limit, include_raw
+            )
+
+    def _select_history(
+        self, user_id: str, limit: int, include_raw: bool
+    ) -> list[sqlite3.Row]:
+        """查詢使用者對話歷史 (同步，於背景執行緒執行)"""
+        # 不取 raw_event 時，SQLite 不需要讀取存放大型 BLOB 的 overflow page
+        sql = _HISTORY_WITH_RAW_SELECT_SQL if include_raw else _HISTORY_SELECT_SQL
+        cursor = self._conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(sql, (user_id, limit))
         rows = cursor.fetchall()
-        conn.close()
+        cursor.close()
+        return rows
+
+    def _decode_raw_event(self, value: bytes | str | None) -> str | None:
+        """還原 raw_event 為 JSON 字串 (相容舊版以 TEXT 儲存的資料)"""
+        if isinstance(value, bytes):
+            return self._decompressor.decompress(value).decode("utf-8")
+        return value
+
+    async def purge_before(self, days: int) -> int:
+        """
+        刪除 days 天前的對話紀錄，並歸還部分空閒 page
+
+        每次只刪除 _PURGE_CHUNK_SIZE 筆，每段之間釋放連線鎖，
+        第一次清除大量舊資料時，Webhook 的批次寫入仍可穿插進行。
+        """
+        modifier = f"-{days} day"
+        deleted = 0
+        while True:
+            async with self._lock:
+                count = await asyncio.to_thread(self._purge_chunk, modifier)
+            deleted += count
+            if count < _PURGE_CHUNK_SIZE:
+                break
+
+        if deleted and self._auto_vacuum == _AUTO_VACUUM_INCREMENTAL:
+            async with self._lock:
+                await asyncio.to_thread(self._vacuum_free_pages)
+        elif deleted:
+            logger.warning(
+                f"SQLite 資料庫未啟用 auto_vacuum=INCREMENTAL (目前為 {self._auto_vacuum})，"
+                "刪除後的空間不會歸還，檔案不會縮小；"
+                "請在停機時執行一次 PRAGMA auto_vacuum=INCREMENTAL; VACUUM;"
+            )
+
+        logger.info(f"已刪除 {deleted} 筆超過 {days} 天的對話紀錄")
+        return deleted
+
+    def _purge_chunk(self, modifier: str) -> int:
+        """刪除一段過期紀錄 (同步，於背景執行緒執行)"""
+        cursor = self._conn.execute(_PURGE_CHUNK_SQL, (modifier, _PURGE_CHUNK_SIZE))
+        return cursor.rowcount
+
+    def _vacuum_free_pages(self):
+        """歸還空閒 page (同步，於背景執行緒執行)"""
+        # 每次最多歸還 1000 個 page，避免長時間佔住寫入鎖
+        # (incremental_vacuum 每個 step 只歸還一個 page，executescript 會執行到完成為止)
+        self._conn.executescript("PRAGMA incremental_vacuum(1000)")
+
+    async def snapshot(self, path: str | Path):
+        """
+        將目前的資料庫內容備份到檔案 (例如把 :memory: 資料庫存到磁碟)
+
+        使用 SQLite online backup，備份期間不需要停止服務。
+        還在佇列中、尚未寫入的事件不會包含在備份中。
 
-        return [dict(row) for row in rows]
+        Args:
+            path: 備份檔案路徑 (已存在的檔案會被覆蓋)
+        """
+        async with self._lock:
+            await asyncio.to_thread(self._backup, path)
+
+    def _backup(self, path: str | Path):
+        """備份資料庫到檔案 (同步，於背景執行緒執行)"""
+        target = sqlite3.connect(path)
+        try:
+            self._conn.backup(target)
+        finally:
+            target.close()
+        logger.info(f"SQLite 資料庫已備份: {path}")
+
+    async def close(self):
+        """寫入佇列中剩餘的事件後關閉資料庫連線"""
+        await self._queue.close()
+        self._conn.close()
 
 
 class FirestoreStorage(ConversationStorage):
@@ -164,6 +669,7 @@ class FirestoreStorage(ConversationStorage):
 
     def __init__(self, project_id: str):
         try:
+            from google.api_core import exceptions as api_exceptions
             from google.cloud import firestore
         except ImportError:
             raise ImportError(
@@ -171,7 +677,19 @@ class FirestoreStorage(ConversationStorage):
             )
 
         self.db = firestore.AsyncClient(project=project_id)
+        # 暫時性的錯誤 (逾時、服務忙碌等) 會重試，其他錯誤直接改為逐筆寫入
+        self._transient_errors = (
+            api_exceptions.Aborted,
+            api_exceptions.DeadlineExceeded,
+            api_exceptions.InternalServerError,
+            api_exceptions.ServiceUnavailable,
+            api_exceptions.TooManyRequests,
+        )
         self.collection = self.db.collection("line_conversations")
+        # 事件 ID 序號：從啟動時間 (ns) 開始遞增，同一瞬間的多個事件也不會重複
+        self._seq = itertools.count(time.time_ns())
+        # 事件累積成批後以單一 WriteBatch 寫入，減少 RPC 次數
+        self._queue = _WriteQueue(self._commit_batch, batch_size=_FIRESTORE_BATCH_SIZE)
         logger.info(f"Firestore 已連接: project={project_id}")
 
     async def save_event(
@@ -185,85 +703,137 @@ class FirestoreStorage(ConversationStorage):
         route_target: str | None = None,
         route_reason: str | None = None,
     ) -> str:
-        """儲存事件到 Firestore"""
+        """
+        儲存事件到 Firestore
+
+        事件先放入佇列後立即回傳，由背景 task 累積成批後一次 commit。
+        """
         from google.cloud import firestore
 
-        event_id = f"{user_id}_{datetime.now().timestamp()}"
+        event_id = _make_event_id(user_id, raw_event, self._seq)
 
         doc_ref = self.collection.document(event_id)
-        await doc_ref.set(
-            {
-                "user_id": user_id,
-                "event_type": event_type,
-                "message_type": message_type,
-                "message_text": message_text,
-                "reply_token": reply_token,
-                "route_target": route_target,
-                "route_reason": route_reason,
-                "raw_event": raw_event,
-                "created_at": firestore.SERVER_TIMESTAMP,
-            }
+        await self._queue.put(
+            (
+                doc_ref,
+                {
+                    "user_id": user_id,
+                    "event_type": event_type,
+                    "message_type": message_type,
+                    "message_text": message_text,
+                    "reply_token": reply_token,
+                    "route_target": route_target,
+                    "route_reason": route_reason,
+                    "raw_event": raw_event,
+                    "created_at": firestore.SERVER_TIMESTAMP,
+                },
+            )
         )
 
-        logger.debug(f"已儲存事件到 Firestore: {event_id}")
         return event_id
 
+    async def _commit_batch(self, writes: list[tuple]):
+        """
+        寫入一批事件 (由批次寫入佇列呼叫)
+
+        WriteBatch 是全有或全無：暫時性錯誤會重試整批，仍然失敗 (或有無效的文件) 時
+        改為逐筆 set()，只捨棄寫不進去的文件。
+        """
+        try:
+            await _call_with_retries(
+                self._commit_writes, writes, retry_on=self._transient_errors
+            )
+            logger.debug(f"已批次儲存 {len(writes)} 筆事件到 Firestore")
+            return
+        except Exception as e:
+            logger.error(f"Firestore 批次寫入 {len(writes)} 筆失敗，改為逐筆寫入: {e}")
+
+        dropped = 0
+        for doc_ref, data in writes:
+            try:
+                await _call_with_retries(doc_ref.set, data, retry_on=self._transient_errors)
+            except Exception as e:
+                dropped += 1
+                logger.error(f"寫入 Firestore 文件失敗，捨棄: {doc_ref.id}: {e}")
+        if dropped:
+            logger.error(f"Firestore 批次寫入共捨棄 {dropped} / {len(writes)} 筆")
+
+    async def _commit_writes(self, writes: list[tuple]):
+        """以單一 WriteBatch commit 一批事件"""
+        batch = self.db.batch()
+        for doc_ref, data in writes:
+            batch.set(doc_ref, data)
+        await batch.commit()
+
     async def get_user_history(
-        self, user_id: str, limit: int = 50
+        self, user_id: str, limit: int = 50, include_raw: bool = False
     ) -> list[dict]:
-        """取得使用者對話歷史"""
+        """
+        取得使用者對話歷史
+
+        需要 (user_id ASC, created_at DESC) 複合索引，見 firestore.indexes.json
+        """
+        from google.cloud import firestore
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
         query = (
-            self.collection.where("user_id", "==", user_id)
-            .order_by("created_at", direction="DESCENDING")
+            self.collection.where(filter=FieldFilter("user_id", "==", user_id))
+            .order_by("created_at", direction=firestore.Query.DESCENDING)
             .limit(limit)
         )
+        if not include_raw:
+            query = query.select(_FIRESTORE_HISTORY_FIELDS)
 
         docs = await query.get()
-        return [doc.to_dict() for doc in docs]
+        # 補上文件 ID，讓結果與 SQLite 一樣帶有 event_id
+        return [{"event_id": doc.id, **doc.to_dict()} for doc in docs]
+
+    async def close(self):
+        """寫入佇列中剩餘的事件"""
+        await self._queue.close()
 
 
 # Storage 工廠函數
-_storage: ConversationStorage | None = None
+# 啟動時由 init_storage() 建立，之後每個事件直接使用，不需再判斷資料庫類型
+STORAGE: ConversationStorage | None = None
 
 
-def get_storage() -> ConversationStorage:
-    """取得存儲實例 (單例模式)"""
-    global _storage
-    if _storage is None:
+def init_storage() -> ConversationStorage:
+    """建立存儲實例 (應用程式啟動時呼叫一次)"""
+    global STORAGE, save_conversation
+    if STORAGE is None:
         settings = get_settings()
 
         if settings.database_type == DatabaseType.SQLITE:
-            _storage = SQLiteStorage(settings.database_url)
+            STORAGE = SQLiteStorage(settings.database_url)
         elif settings.database_type == DatabaseType.FIRESTORE:
             if not settings.firestore_project_id:
                 raise ValueError("使用 Firestore 需要設定 FIRESTORE_PROJECT_ID")
-            _storage = FirestoreStorage(settings.firestore_project_id)
+            STORAGE = FirestoreStorage(settings.firestore_project_id)
         else:
             # 預設使用 SQLite
-            _storage = SQLiteStorage(settings.database_url)
-
-    return _storage
-
-
-async def save_conversation(
-    user_id: str,
-    event_type: str,
-    message_type: str | None,
-    message_text: str | None,
-    reply_token: str | None,
-    raw_event: dict,
-    route_target: str | None = None,
-    route_reason: str | None = None,
-) -> str:
-    """便捷函數 - 儲存對話"""
-    storage = get_storage()
-    return await storage.save_event(
-        user_id=user_id,
-        event_type=event_type,
-        message_type=message_type,
-        message_text=message_text,
-        reply_token=reply_token,
-        raw_event=raw_event,
-        route_target=route_target,
-        route_reason=route_reason,
-    )
+            STORAGE = SQLiteStorage(settings.database_url)
+
+        save_conversation = STORAGE.save_event
+
+    return STORAGE
+
+
+async def close_storage():
+    """關閉存儲實例 (如果已建立)"""
+    global STORAGE, save_conversation
+    if STORAGE is not None:
+        await STORAGE.close()
+        STORAGE = None
+        save_conversation = _save_before_init
+
+
+async def _save_before_init(**kwargs) -> str:
+    """init_storage() 之前呼叫 save_conversation 時的預設實作"""
+    raise RuntimeError("尚未初始化存儲，請先呼叫 init_storage()")
+
+
+# 便捷函數 - 儲存對話
+# init_storage() 會把它換成 STORAGE.save_event (已綁定的方法)，呼叫時少一層轉發；
+# 呼叫端需透過模組屬性 (storage.save_conversation) 取用，才會拿到替換後的方法
+save_conversation: Callable[..., Awaitable[str]] = _save_before_init
@@ -0,0 +1,17 @@
+"""測試共用的 fixture"""
+
+from dataclasses import replace
+
+import pytest
+
+from line_gateway.config import RuntimeSettings, Settings
+
+
+@pytest.fixture
+def make_rt():
+    """建立執行期設定 (不讀取 .env，可覆寫個別欄位)"""
+
+    def make(**overrides) -> RuntimeSettings:
+        return replace(RuntimeSettings.from_settings(Settings(_env_file=None)), **overrides)
+
+    return make
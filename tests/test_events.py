@@ -0,0 +1,201 @@
+"""事件處理測試 - dispatch_event 與 process_event"""
+
+import asyncio
+
+import pytest
+
+from line_gateway import storage
+from line_gateway.config import ReplyMode
+from line_gateway.forwarder import ForwardResult
+from line_gateway.main import EventServices, dispatch_event, process_event
+from line_gateway.router import RouteResult, RouteTarget
+
+RAW_BODY = b'{"events": []}'
+
+
+class FakeForwarder:
+    """記錄轉發呼叫，可指定回傳的 reply_text 或要拋出的例外"""
+
+    def __init__(self, reply_text: str | None = None, error: Exception | None = None):
+        self.calls = []
+        self._reply_text = reply_text
+        self._error = error
+
+    async def forward_by_route(self, route_result, raw_body, headers):
+        self.calls.append(("route", route_result.target))
+        if self._error is not None:
+            raise self._error
+        return [
+            ForwardResult(
+                success=True,
+                target=route_result.target.value,
+                status_code=200,
+                response_body={"reply_text": self._reply_text} if self._reply_text else {},
+            )
+        ]
+
+    async def forward_to_old_system(self, raw_body, headers, include_reply_token=True):
+        self.calls.append(("old", include_reply_token))
+        return ForwardResult(success=True, target="old_system")
+
+    async def forward_to_new_system(self, raw_body, headers):
+        self.calls.append(("new",))
+        return ForwardResult(success=True, target="new_system")
+
+
+class FakeLineReply:
+    def __init__(self):
+        self.replies = []
+
+    async def reply_text(self, reply_token, text):
+        self.replies.append((reply_token, text))
+        return True
+
+
+class FakeNotify:
+    def __init__(self, error: Exception | None = None):
+        self.sent = []
+        self._error = error
+
+    async def send_notification(self, user_id, message_text, keyword):
+        if self._error is not None:
+            raise self._error
+        self.sent.append((user_id, keyword))
+        return True
+
+
+def make_services(rt, router=None, forwarder=None, notify=None) -> EventServices:
+    return EventServices(
+        rt=rt,
+        router=router,
+        forwarder=forwarder or FakeForwarder(),
+        line_reply=FakeLineReply(),
+        notify=notify or FakeNotify(),
+    )
+
+
+NEW_ROUTE = RouteResult(target=RouteTarget.NEW_SYSTEM, reason="測試")
+
+
+async def test_dispatch_uses_injected_reply_mode(make_rt):
+    services = make_services(make_rt(reply_mode=ReplyMode.DELEGATE_NEW))
+
+    await dispatch_event(NEW_ROUTE, "r1", RAW_BODY, {}, services)
+
+    assert services.forwarder.calls == [("new",)]
+    assert services.line_reply.replies == []
+
+
+async def test_dispatch_unified_replies_once(make_rt):
+    services = make_services(
+        make_rt(reply_mode=ReplyMode.UNIFIED), forwarder=FakeForwarder(reply_text="您好")
+    )
+
+    await dispatch_event(NEW_ROUTE, "r1", RAW_BODY, {}, services)
+
+    assert services.forwarder.calls == [("route", RouteTarget.NEW_SYSTEM)]
+    assert services.line_reply.replies == [("r1", "您好")]
+
+
+# process_event
+
+HIGH_VALUE_ROUTE = RouteResult(
+    target=RouteTarget.NEW_SYSTEM,
+    reason="測試",
+    is_high_value=True,
+    matched_keyword="開公司",
+)
+EVENT = {
+    "type": "message",
+    "replyToken": "r1",
+    "source": {"userId": "U1234567890"},
+    "message": {"type": "text", "text": "我想開公司"},
+}
+
+
+class FakeRouter:
+    def route(self, message_text, message_type="text"):
+        return HIGH_VALUE_ROUTE
+
+
+class SlowNotify(FakeNotify):
+    async def send_notification(self, user_id, message_text, keyword):
+        await asyncio.sleep(0.05)
+        return await super().send_notification(user_id, message_text, keyword)
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """以 list 取代儲存，記錄每次 save_conversation 的欄位"""
+    records = []
+
+    async def save(**fields):
+        records.append(fields)
+        return "event-id"
+
+    monkeypatch.setattr(storage, "save_conversation", save)
+    return records
+
+
+async def test_process_event_runs_steps_concurrently(make_rt, monkeypatch):
+    save_started = asyncio.Event()
+    dispatch_started = asyncio.Event()
+
+    async def save(**fields):
+        save_started.set()
+        await asyncio.wait_for(dispatch_started.wait(), timeout=1)
+
+    class WaitingForwarder(FakeForwarder):
+        async def forward_by_route(self, route_result, raw_body, headers):
+            dispatch_started.set()
+            await asyncio.wait_for(save_started.wait(), timeout=1)
+            return await super().forward_by_route(route_result, raw_body, headers)
+
+    monkeypatch.setattr(storage, "save_conversation", save)
+    services = make_services(make_rt(), router=FakeRouter(), forwarder=WaitingForwarder())
+
+    # 儲存與轉發互相等待對方開始，依序執行的話會逾時
+    await asyncio.wait_for(process_event(EVENT, RAW_BODY, {}, services), timeout=2)
+
+    assert services.forwarder.calls == [("route", RouteTarget.NEW_SYSTEM)]
+    assert services.notify.sent == [("U1234567890", "開公司")]
+
+
+async def test_process_event_survives_save_failure(make_rt, monkeypatch):
+    async def save(**fields):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(storage, "save_conversation", save)
+    services = make_services(make_rt(), router=FakeRouter())
+
+    await process_event(EVENT, RAW_BODY, {}, services)
+
+    assert services.forwarder.calls == [("route", RouteTarget.NEW_SYSTEM)]
+    assert services.notify.sent == [("U1234567890", "開公司")]
+
+
+async def test_dispatch_failure_does_not_orphan_notify(make_rt, saved):
+    services = make_services(
+        make_rt(),
+        router=FakeRouter(),
+        forwarder=FakeForwarder(error=RuntimeError("backend down")),
+        notify=SlowNotify(),
+    )
+
+    await process_event(EVENT, RAW_BODY, {}, services)
+
+    # 轉發失敗時，process_event 仍會等通知送完才結束
+    assert services.notify.sent == [("U1234567890", "開公司")]
+    assert saved[0]["route_target"] == "new_system"
+
+
+async def test_process_event_survives_notify_failure(make_rt, saved):
+    services = make_services(
+        make_rt(), router=FakeRouter(), notify=FakeNotify(error=RuntimeError("webhook down"))
+    )
+
+    await process_event(EVENT, RAW_BODY, {}, services)
+
+    assert services.forwarder.calls == [("route", RouteTarget.NEW_SYSTEM)]
+    assert len(saved) == 1
+
@@ -0,0 +1,25 @@
+"""轉發模組測試 - 轉發 Headers"""
+
+from line_gateway.forwarder import build_forward_headers
+
+
+def test_build_forward_headers_drops_hop_by_hop_headers():
+    raw_headers = [
+        (b"host", b"gateway.example.com"),
+        (b"content-length", b"123"),
+        (b"transfer-encoding", b"chunked"),
+        (b"connection", b"keep-alive"),
+        (b"content-type", b"application/json"),
+        (b"x-line-signature", b"c2lnbmF0dXJl"),
+    ]
+
+    assert build_forward_headers(raw_headers) == {
+        "content-type": "application/json",
+        "x-line-signature": "c2lnbmF0dXJl",
+    }
+
+
+def test_build_forward_headers_keeps_latin1_values():
+    assert build_forward_headers([(b"user-agent", "LineBotWebhook/2.0 é".encode("latin-1"))]) == {
+        "user-agent": "LineBotWebhook/2.0 é"
+    }
@@ -0,0 +1,26 @@
+"""http_clients 模組測試"""
+
+import pytest
+
+from line_gateway import http_clients
+from line_gateway.config import Settings
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+async def test_make_client_defaults_to_http2_setting(monkeypatch, enabled):
+    monkeypatch.setattr(
+        http_clients, "get_settings", lambda: Settings(_env_file=None, http2_enabled=enabled)
+    )
+    seen = []
+    real_client = http_clients.httpx.AsyncClient
+
+    def record_client(**kwargs):
+        seen.append(kwargs["http2"])
+        return real_client(**kwargs)
+
+    monkeypatch.setattr(http_clients.httpx, "AsyncClient", record_client)
+
+    client = http_clients.make_client()
+    await client.aclose()
+
+    assert seen == [enabled]
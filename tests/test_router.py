@@ -0,0 +1,69 @@
+"""路由模組測試 - 關鍵字判斷"""
+
+import pytest
+
+from line_gateway import router as router_module
+from line_gateway.router import MessageRouter, RouteTarget
+
+
+@pytest.fixture
+def make_router(make_rt, monkeypatch):
+    def make(old=("繳費", "地址"), high_value=("開公司", "創業")) -> MessageRouter:
+        rt = make_rt(old_keywords_list=tuple(old), high_value_keywords_list=tuple(high_value))
+        monkeypatch.setattr(router_module, "get_runtime_settings", lambda: rt)
+        return MessageRouter()
+
+    return make
+
+
+def test_old_keyword_routes_to_old_system(make_router):
+    result = make_router().route("我要繳費")
+
+    assert result.target == RouteTarget.OLD_SYSTEM
+    assert result.matched_keyword == "繳費"
+    assert not result.is_high_value
+
+
+def test_high_value_keyword_is_flagged(make_router):
+    result = make_router().route("我想開公司")
+
+    assert result.target == RouteTarget.NEW_SYSTEM
+    assert result.is_high_value
+    assert result.matched_keyword == "開公司"
+
+
+def test_old_keyword_beats_high_value_keyword(make_router):
+    # 高價值關鍵字出現在前面，仍以舊系統關鍵字為準
+    result = make_router().route("想開公司，先問地址")
+
+    assert result.target == RouteTarget.OLD_SYSTEM
+    assert result.matched_keyword == "地址"
+    assert not result.is_high_value
+
+
+def test_keyword_in_both_lists_routes_to_old_system(make_router):
+    result = make_router(old=("預約",), high_value=("預約",)).route("我要預約")
+
+    assert result.target == RouteTarget.OLD_SYSTEM
+    assert not result.is_high_value
+
+
+def test_plain_text_routes_to_new_system(make_router):
+    result = make_router().route("今天天氣如何")
+
+    assert result.target == RouteTarget.NEW_SYSTEM
+    assert result.matched_keyword is None
+
+
+def test_no_keywords_configured(make_router):
+    router = make_router(old=(), high_value=())
+
+    assert router.route("我要繳費").target == RouteTarget.NEW_SYSTEM
+
+
+def test_non_text_message_result_is_cached(make_router):
+    router = make_router()
+
+    first = router.route(None, "sticker")
+    assert first.target == RouteTarget.NEW_SYSTEM
+    assert router.route(None, "sticker") is first
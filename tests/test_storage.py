@@ -0,0 +1,467 @@
+"""storage 模組測試 - 批次寫入佇列、SQLiteStorage"""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from line_gateway import storage
+from line_gateway.config import Settings
+from line_gateway.storage import SQLiteStorage, _WriteQueue
+
+
+def make_event(**overrides) -> dict:
+    """建立 save_event / bulk_import 使用的事件欄位"""
+    event = {
+        "user_id": "U1",
+        "event_type": "message",
+        "message_type": "text",
+        "message_text": "你好",
+        "reply_token": "r1",
+        "raw_event": {"type": "message", "message": {"text": "你好"}},
+        "route_target": "new_system",
+        "route_reason": "預設",
+    }
+    event.update(overrides)
+    return event
+
+
+def count_rows(db: SQLiteStorage) -> int:
+    return db._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+
+async def wait_for_rows(db: SQLiteStorage, expected: int, timeout: float = 2.0):
+    """等待背景 task 寫入指定筆數"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while count_rows(db) < expected:
+        if loop.time() > deadline:
+            pytest.fail(f"等待寫入逾時: {count_rows(db)} / {expected}")
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+async def db():
+    db = SQLiteStorage(":memory:")
+    yield db
+    await db.close()
+
+
+# _WriteQueue
+
+
+async def test_write_queue_splits_batches_and_drains_on_close():
+    batches = []
+
+    async def write_batch(items):
+        batches.append(list(items))
+
+    queue = _WriteQueue(write_batch, batch_size=3, flush_interval=0.01)
+    for i in range(7):
+        await queue.put(i)
+    await queue.close()
+
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert [item for batch in batches for item in batch] == list(range(7))
+
+
+async def test_write_queue_retries_failed_batch():
+    calls = []
+
+    async def write_batch(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+
+    queue = _WriteQueue(write_batch, batch_size=10, flush_interval=0.01, retry_delay=0.001)
+    await queue.put("a")
+    await queue.put("b")
+    await queue.close()
+
+    assert calls == [["a", "b"], ["a", "b"]]
+
+
+async def test_write_queue_falls_back_to_single_items():
+    written = []
+
+    async def write_batch(items):
+        if "bad" in items:
+            raise ValueError("無效的資料")
+        written.extend(items)
+
+    queue = _WriteQueue(write_batch, batch_size=10, flush_interval=0.01, retry_delay=0.001)
+    for item in ("a", "bad", "b"):
+        await queue.put(item)
+    await queue.close()
+
+    assert written == ["a", "b"]
+
+
+async def test_write_queue_applies_backpressure():
+    release = asyncio.Event()
+    written = []
+
+    async def write_batch(items):
+        await release.wait()
+        written.extend(items)
+
+    queue = _WriteQueue(write_batch, batch_size=1, flush_interval=0.01, max_pending=2)
+    for item in range(3):
+        await queue.put(item)  # 第一筆被背景 task 取走，佇列剩 2 筆 (已滿)
+    await asyncio.sleep(0.05)
+
+    blocked = asyncio.create_task(queue.put(3))
+    await asyncio.sleep(0.05)
+    assert not blocked.done()
+
+    release.set()
+    await blocked
+    await queue.close()
+    assert written == [0, 1, 2, 3]
+
+
+async def test_write_queue_restarts_after_close():
+    batches = []
+
+    async def write_batch(items):
+        batches.append(list(items))
+
+    queue = _WriteQueue(write_batch, batch_size=10, flush_interval=0.01)
+    await queue.put(1)
+    await queue.close()
+    await queue.put(2)
+    await queue.close()
+
+    assert batches == [[1], [2]]
+
+
+# SQLiteStorage 寫入
+
+
+async def test_save_event_is_flushed_in_background(db):
+    event_ids = [await db.save_event(**make_event(message_text=f"m{i}")) for i in range(5)]
+
+    await wait_for_rows(db, 5)
+
+    assert len(set(event_ids)) == 5
+    history = await db.get_user_history("U1")
+    assert {row["event_id"] for row in history} == set(event_ids)
+
+
+async def test_close_drains_pending_rows(tmp_path):
+    path = tmp_path / "conversations.db"
+    db = SQLiteStorage(f"sqlite:///{path}")
+    for i in range(250):
+        await db.save_event(**make_event(message_text=f"m{i}"))
+    await db.close()
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0] == 250
+    conn.close()
+
+
+async def test_duplicate_row_only_skips_offending_row(db):
+    await db._write_batch([db._build_row(**make_event(), event_id="dup")])
+
+    rows = [
+        db._build_row(**make_event(message_text="before")),
+        db._build_row(**make_event(message_text="dup"), event_id="dup"),
+        db._build_row(**make_event(message_text="after")),
+    ]
+    await db._write_batch(rows)
+
+    texts = {row[0] for row in db._conn.execute("SELECT message_text FROM conversations")}
+    assert texts == {"你好", "before", "after"}
+
+
+async def test_large_batch_uses_multiple_statements(db):
+    for i in range(storage._ROWS_PER_STATEMENT * 2 + 7):
+        await db.save_event(**make_event(message_text=f"m{i}"))
+
+    await wait_for_rows(db, storage._ROWS_PER_STATEMENT * 2 + 7)
+
+    texts = {row[0] for row in db._conn.execute("SELECT message_text FROM conversations")}
+    assert len(texts) == storage._ROWS_PER_STATEMENT * 2 + 7
+
+
+# SQLiteStorage 查詢
+
+
+async def test_raw_event_is_stored_compressed(db):
+    await db.save_event(**make_event(raw_event={"text": "中文" * 100}))
+    await wait_for_rows(db, 1)
+
+    (stored,) = db._conn.execute("SELECT raw_event FROM conversations").fetchone()
+    assert isinstance(stored, bytes)
+    assert len(stored) < len('{"text":"' + "中文" * 100 + '"}')
+
+    (row,) = await db.get_user_history("U1", include_raw=True)
+    assert row["raw_event"] == '{"text":"' + "中文" * 100 + '"}'
+
+
+async def test_history_decodes_legacy_text_raw_event(db):
+    db._conn.execute(
+        "INSERT INTO conversations (event_id, user_id, event_type, raw_event) "
+        "VALUES ('legacy', 'U1', 'message', '{\"a\":1}')"
+    )
+
+    (row,) = await db.get_user_history("U1", include_raw=True)
+    assert row["raw_event"] == '{"a":1}'
+
+
+async def test_history_excludes_raw_event_by_default(db):
+    await db.save_event(**make_event(raw_event={"text": "中文"}))
+    await wait_for_rows(db, 1)
+
+    (row,) = await db.get_user_history("U1")
+    assert "raw_event" not in row.keys()
+    assert row["id"] == 1
+    assert row["event_id"].startswith("U1_")
+
+    (row,) = await db.get_user_history("U1", include_raw=True)
+    assert row["raw_event"] == '{"text":"中文"}'
+
+
+# bulk_import
+
+
+async def test_bulk_import_skips_replayed_events(db):
+    event = make_event(raw_event={"webhookEventId": "01HXYZ", "type": "message"})
+
+    assert await db.bulk_import([event]) == 1
+    assert await db.bulk_import([event]) == 0
+    assert await db.bulk_import([event, event]) == 0
+    assert count_rows(db) == 1
+
+    (row,) = await db.get_user_history("U1")
+    assert row["event_id"] == "U1_01HXYZ"
+
+
+async def test_bulk_import_skips_events_saved_live(db):
+    raw_event = {"webhookEventId": "01HLIVE", "type": "message"}
+    event_id = await db.save_event(**make_event(raw_event=raw_event))
+    await wait_for_rows(db, 1)
+
+    assert event_id == "U1_01HLIVE"
+    assert await db.bulk_import([make_event(raw_event=raw_event)]) == 0
+    assert count_rows(db) == 1
+
+
+async def test_redelivered_live_event_is_stored_once(db):
+    raw_event = {"webhookEventId": "01HREDELIVER", "type": "message"}
+    await db.save_event(**make_event(raw_event=raw_event))
+    await wait_for_rows(db, 1)
+    await db.save_event(**make_event(raw_event=raw_event))
+    await db.save_event(**make_event(message_text="other"))
+    await wait_for_rows(db, 2)
+
+    assert count_rows(db) == 2
+
+
+async def test_bulk_import_uses_caller_event_id(db, monkeypatch):
+    monkeypatch.setattr(storage, "_IMPORT_CHUNK_SIZE", 2)
+    events = [make_event(event_id=f"e{i}") for i in range(5)]
+
+    assert await db.bulk_import(iter(events)) == 5
+    assert await db.bulk_import(events + [make_event(event_id="e5")]) == 1
+    assert count_rows(db) == 6
+
+
+async def test_bulk_import_restores_indexes(db):
+    await db.bulk_import([make_event()])
+
+    indexes = {row[1] for row in db._conn.execute("PRAGMA index_list(conversations)")}
+    assert {name for name, _ in storage._SECONDARY_INDEXES} <= indexes
+
+
+async def test_bulk_import_rolls_back_on_error(db):
+    with pytest.raises(TypeError):
+        await db.bulk_import([make_event(event_id="ok"), {"unknown": 1}])
+
+    assert count_rows(db) == 0
+    assert not db._conn.in_transaction
+
+
+# 記憶體資料庫與備份
+
+
+async def test_memory_url_does_not_create_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db = SQLiteStorage("sqlite:///:memory:")
+    await db.save_event(**make_event())
+    await wait_for_rows(db, 1)
+    await db.close()
+
+    assert db.db_path == ":memory:"
+    assert list(tmp_path.iterdir()) == []
+
+
+async def test_snapshot_copies_database_to_file(db, tmp_path):
+    await db.save_event(**make_event())
+    await wait_for_rows(db, 1)
+
+    path = tmp_path / "snapshot.db"
+    await db.snapshot(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0] == 1
+    conn.close()
+
+
+# 保留期限
+
+
+def test_retention_is_opt_in():
+    assert Settings(_env_file=None).conversation_retention_days == 0
+
+
+async def test_purge_before_deletes_only_old_rows(db, monkeypatch):
+    monkeypatch.setattr(storage, "_PURGE_CHUNK_SIZE", 2)
+    for i in range(5):
+        db._conn.execute(
+            "INSERT INTO conversations (event_id, user_id, event_type, created_at) "
+            "VALUES (?, 'U1', 'message', datetime('now', '-100 day'))",
+            (f"old{i}",),
+        )
+    await db.save_event(**make_event())
+    await wait_for_rows(db, 6)
+
+    assert await db.purge_before(90) == 5
+    (row,) = await db.get_user_history("U1")
+    assert not row["event_id"].startswith("old")
+
+
+async def test_new_database_uses_incremental_auto_vacuum(db):
+    assert db._conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+# FirestoreStorage
+
+
+class TransientError(Exception):
+    """代替 google.api_core 的暫時性錯誤"""
+
+
+class FakeDocument:
+    def __init__(self, doc_id: str, store: dict, fail_with: Exception | None = None):
+        self.id = doc_id
+        self._store = store
+        self._fail_with = fail_with
+
+    async def set(self, data: dict):
+        if self._fail_with is not None:
+            raise self._fail_with
+        self._store[self.id] = data
+
+
+class FakeBatch:
+    def __init__(self, db: "FakeFirestore"):
+        self._db = db
+        self._writes = []
+
+    def set(self, doc_ref: FakeDocument, data: dict):
+        self._writes.append((doc_ref, data))
+
+    async def commit(self):
+        self._db.commits += 1
+        if self._db.commit_errors:
+            raise self._db.commit_errors.pop(0)
+        for doc_ref, data in self._writes:
+            await doc_ref.set(data)
+
+
+class FakeFirestore:
+    def __init__(self, commit_errors: list[Exception] | None = None):
+        self.commit_errors = commit_errors or []
+        self.commits = 0
+        self.docs: dict = {}
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch(self)
+
+    def document(self, doc_id: str, fail_with: Exception | None = None) -> FakeDocument:
+        return FakeDocument(doc_id, self.docs, fail_with)
+
+
+def make_firestore(fake: FakeFirestore) -> storage.FirestoreStorage:
+    """不連線 GCP，直接注入假的 client"""
+    fs = storage.FirestoreStorage.__new__(storage.FirestoreStorage)
+    fs.db = fake
+    fs._transient_errors = (TransientError,)
+    return fs
+
+
+@pytest.fixture
+def fast_retry(monkeypatch):
+    monkeypatch.setattr(storage, "_RETRY_DELAY", 0.001)
+
+
+async def test_firestore_commit_retries_transient_errors(fast_retry):
+    fake = FakeFirestore(commit_errors=[TransientError("unavailable")])
+    fs = make_firestore(fake)
+
+    await fs._commit_batch([(fake.document("a"), {"n": 1}), (fake.document("b"), {"n": 2})])
+
+    assert fake.commits == 2
+    assert fake.docs == {"a": {"n": 1}, "b": {"n": 2}}
+
+
+async def test_firestore_commit_falls_back_to_single_documents(fast_retry):
+    fake = FakeFirestore(commit_errors=[ValueError("invalid document")])
+    fs = make_firestore(fake)
+
+    await fs._commit_batch(
+        [
+            (fake.document("a"), {"n": 1}),
+            (fake.document("bad", fail_with=ValueError("invalid document")), {"n": 2}),
+            (fake.document("b"), {"n": 3}),
+        ]
+    )
+
+    assert fake.commits == 1
+    assert fake.docs == {"a": {"n": 1}, "b": {"n": 3}}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: dict):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self) -> dict:
+        return dict(self._data)
+
+
+class FakeQuery:
+    def __init__(self, docs: list[FakeSnapshot]):
+        self.docs = docs
+        self.selected = None
+
+    def where(self, filter=None):
+        return self
+
+    def order_by(self, field, direction=None):
+        return self
+
+    def limit(self, count):
+        return self
+
+    def select(self, fields):
+        self.selected = tuple(fields)
+        return self
+
+    async def get(self):
+        return self.docs
+
+
+async def test_firestore_history_includes_document_id():
+    pytest.importorskip("google.cloud.firestore")  # 查詢會使用 FieldFilter 與 Query.DESCENDING
+    query = FakeQuery([FakeSnapshot("U1_01H", {"user_id": "U1", "message_text": "你好"})])
+    fs = make_firestore(FakeFirestore())
+    fs.collection = query
+
+    (record,) = await fs.get_user_history("U1")
+
+    assert record == {"event_id": "U1_01H", "user_id": "U1", "message_text": "你好"}
+    assert "event_id" not in query.selected
+    assert "raw_event" not in query.selected
+
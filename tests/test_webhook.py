@@ -0,0 +1,61 @@
+"""Webhook 端點測試 - 簽名驗證"""
+
+import base64
+import hashlib
+import hmac
+from dataclasses import replace
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+from line_gateway.config import RuntimeSettings, Settings
+from line_gateway.main import app, get_event_services, verify_signature
+
+SECRET = b"channel-secret"
+BODY = orjson.dumps({"destination": "U0", "events": []})
+
+
+def sign(body: bytes, secret: bytes = SECRET) -> str:
+    return base64.b64encode(hmac.new(secret, body, hashlib.sha256).digest()).decode()
+
+
+@pytest.fixture
+def client():
+    """不經過 lifespan 的 client，只設定 webhook 需要的執行期設定"""
+    rt = RuntimeSettings.from_settings(Settings(_env_file=None))
+    app.state.rt = replace(rt, line_channel_secret_bytes=SECRET)
+    app.dependency_overrides[get_event_services] = lambda: None
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+    del app.state.rt
+
+
+def test_verify_signature():
+    assert verify_signature(BODY, sign(BODY), SECRET)
+    assert not verify_signature(BODY, sign(BODY, b"other"), SECRET)
+    assert not verify_signature(BODY, "不是 base64", SECRET)
+
+
+def test_webhook_accepts_valid_signature(client):
+    response = client.post("/webhook", content=BODY, headers={"X-Line-Signature": sign(BODY)})
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+
+def test_webhook_rejects_invalid_signature(client):
+    response = client.post("/webhook", content=BODY, headers={"X-Line-Signature": sign(b"x")})
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Invalid signature"
+
+
+def test_webhook_requires_signature_when_secret_is_set(client):
+    response = client.post("/webhook", content=BODY)
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Missing signature"
+
+
+def test_webhook_skips_verification_without_secret(client):
+    app.state.rt = replace(app.state.rt, line_channel_secret_bytes=b"")
+    response = client.post("/webhook", content=BODY)
+    assert response.status_code == 200